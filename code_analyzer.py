@@ -1,48 +1,118 @@
 import os
 import re
 import sys
+import time
 import ast
+import json
+import hashlib
 import argparse
-from collections import defaultdict
+from collections import OrderedDict, defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
+# Bump whenever a check changes, so cached results from older rules are not reused
+ANALYZER_VERSION = "4"
+CACHE_FILENAME = ".code_analyzer_cache.json"
+DEFAULT_CACHE_SIZE = 50000
+
+
+CAMEL_CASE = re.compile(r"[A-Z][a-zA-Z0-9]*$")
+FUNCTION_NAME = re.compile(r"[_a-z][_a-zA-Z0-9]*$")
+SNAKE_CASE = re.compile(r"[_a-z][_a-z0-9]*$")
+
+
+class Diagnostic(namedtuple("Diagnostic", "filename line code message")):
+    __slots__ = ()
+
+    def __str__(self):
+        return f"{self.filename}: Line {self.line}: {self.code} {self.message}"
+
+
+class CodeAnalyzerVisitor:
+    """Walks a tree once and hands every node to the checks registered for its type."""
+
+    def __init__(self, checks):
+        self.checks = checks
+        self.handlers = defaultdict(list)
+        for check in checks:
+            for node_type in check.node_types:
+                self.handlers[node_type].append(getattr(check, f"visit_{node_type.__name__}"))
+
+    def visit(self, tree):
+        handlers = self.handlers
+        for node in ast.walk(tree):
+            for handler in handlers.get(type(node), ()):
+                handler(node)
+        for check in self.checks:
+            check.finish()
+
+
+class AstCheck:
+    """Base class for AST checks; node_types lists the nodes passed to visit_<NodeType>."""
+    node_types = ()
 
-class CodeAnalyzerVisitor(ast.NodeVisitor):
     def __init__(self, filename, output_list):
         self.filename = filename
         self.output_list = output_list
 
+    def report(self, lineno, code, message):
+        self.output_list.append(Diagnostic(self.filename, lineno, code, message))
+
+    def finish(self):
+        pass
+
+
+class ClassNameCheck(AstCheck):
+    node_types = (ast.ClassDef,)
+
     def visit_ClassDef(self, node):
-        class_name = node.name
-        if not re.match(r"[A-Z][a-zA-Z0-9]*$", class_name):
-            self.output_list.append(f"{self.filename}: Line {node.lineno}: S008 Class name should use CamelCase")
-        self.generic_visit(node)
+        if not CAMEL_CASE.match(node.name):
+            self.report(node.lineno, "S008", "Class name should use CamelCase")
+
+
+class FunctionNameCheck(AstCheck):
+    node_types = (ast.FunctionDef, ast.AsyncFunctionDef)
 
     def visit_FunctionDef(self, node):
-        function_name = node.name
-        if not re.match(r"[_a-z][_a-zA-Z0-9]*$", function_name):
-            self.output_list.append(f"{self.filename}: Line {node.lineno}: S009 Function name should use snake_case")
-        self.generic_visit(node)
+        if not FUNCTION_NAME.match(node.name):
+            self.report(node.lineno, "S009", "Function name should use snake_case")
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
 
+class CodeAnalyzer(AstCheck):
+    node_types = (ast.FunctionDef, ast.AsyncFunctionDef, ast.Name)
 
-class CodeAnalyzer:
-    def __init__(self):
+    def __init__(self, filename, output_list):
+        super().__init__(filename, output_list)
         self.stats = {
             "variables": defaultdict(list),
             "parameters": defaultdict(list),
-            "is_constant_default": defaultdict(list),
+            "is_mutable_default": defaultdict(list),
         }
+        self.function_lines = set()
 
     def visit_Name(self, node):
         if isinstance(node.ctx, ast.Store):
             self.stats["variables"][node.lineno].append(node.id)
-        self.generic_visit(node)
 
     def visit_FunctionDef(self, node):
-        for a in node.args.args:
+        args = node.args
+        positional = args.posonlyargs + args.args
+        # positional defaults belong to the last positional arguments, while kw_defaults
+        # has an entry, None when there is no default, for every keyword-only argument
+        defaults = [None] * (len(positional) - len(args.defaults)) + args.defaults
+        parameters = list(zip(positional, defaults))
+        if args.vararg:
+            parameters.append((args.vararg, None))
+        parameters.extend(zip(args.kwonlyargs, args.kw_defaults))
+        if args.kwarg:
+            parameters.append((args.kwarg, None))
+        for a, default in parameters:
             self.stats["parameters"][node.lineno].append(a.arg)
-        for a in node.args.defaults:
-            self.stats["is_constant_default"][node.lineno].append(isinstance(a, ast.Constant))
-        self.generic_visit(node)
+            self.stats["is_mutable_default"][node.lineno].append(isinstance(default, (ast.List, ast.Dict, ast.Set)))
+        self.function_lines.update(range(node.body[0].lineno, node.end_lineno + 1))
+
+    visit_AsyncFunctionDef = visit_FunctionDef
 
     def get_parameters(self, lineno):
         return self.stats["parameters"][lineno]
@@ -51,96 +121,385 @@ class CodeAnalyzer:
         return self.stats["variables"][lineno]
 
     def get_mutable_defaults(self, lineno):
-        for param_name, is_default in zip(self.stats["parameters"][lineno], self.stats["is_constant_default"][lineno]):
-            if not is_default:
+        for param_name, is_mutable in zip(self.stats["parameters"][lineno], self.stats["is_mutable_default"][lineno]):
+            if is_mutable:
                 return param_name
         return ""
 
+    def finish(self):
+        for lineno, parameters in self.stats["parameters"].items():
+            for name in parameters:
+                if not SNAKE_CASE.match(name):
+                    self.report(lineno, "S010", f"Argument name '{name}' should be snake_case")
+            if self.get_mutable_defaults(lineno):
+                self.report(lineno, "S012", "Default argument value is mutable")
+        for lineno, variables in self.stats["variables"].items():
+            if lineno not in self.function_lines:
+                continue
+            for name in dict.fromkeys(variables):
+                if not SNAKE_CASE.match(name):
+                    self.report(lineno, "S011", f"Variable '{name}' in function should be snake_case")
+
+
+AST_CHECKS = [ClassNameCheck, FunctionNameCheck, CodeAnalyzer]
+
+
+def check_tree(filename, tree, output_list, checks=AST_CHECKS):
+    CodeAnalyzerVisitor([check(filename, output_list) for check in checks]).visit(tree)
+
+
+def benchmark_ast(scripts, repeat=5):
+    """Compare one dispatching traversal with one traversal per check."""
+    trees = []
+    for script in scripts:
+        with open(script) as f:
+            try:
+                trees.append((script, ast.parse(f.read())))
+            except SyntaxError:
+                pass
+
+    def run(passes):
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for script, tree in trees:
+                for checks in passes:
+                    check_tree(script, tree, [], checks)
+            best = min(best, time.perf_counter() - started)
+        return best
+
+    one_pass = run([AST_CHECKS])
+    n_passes = run([[check] for check in AST_CHECKS])
+    print(f"{len(trees)} files, {len(AST_CHECKS)} AST checks, best of {repeat}")
+    print(f"one pass: {one_pass:.4f}s")
+    print(f"{len(AST_CHECKS)} passes: {n_passes:.4f}s ({n_passes / one_pass:.2f}x)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pathname", nargs="?")
+    parser.add_argument("-r", "--recursive", action="store_true",
+                        help="scan .py files in subdirectories too")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help="number of processes analyzing files in parallel")
+    parser.add_argument("--timings", action="store_true",
+                        help="report the time spent in each line rule on stderr")
+    parser.add_argument("--cache", action="store_true",
+                        help=f"reuse results for unchanged files from {CACHE_FILENAME}")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE,
+                        help="maximum number of files kept in the cache")
+    parser.add_argument("--format", choices=REPORTERS, default="text",
+                        help="output format of the diagnostics")
+    parser.add_argument("--benchmark-ast", action="store_true",
+                        help="time one AST traversal against one traversal per check instead of reporting")
+    return parser.parse_args()
+
+
+def find_scripts(pathname, recursive=False):
+    if os.path.isfile(pathname):
+        return [pathname]
+    return collect_scripts(pathname, recursive)
 
-def input_path():
-    args = sys.argv
-    if len(args) < 2:
-        return
-    if not os.path.exists(args[1]):
-        return
-    return args[1]
 
+def collect_scripts(pathname, recursive=False):
+    if not recursive:
+        scripts = (os.path.join(pathname, script) for script in sorted(os.listdir(pathname)))
+        return [script for script in scripts
+                if os.path.isfile(script) and os.path.basename(script) != CACHE_FILENAME]
+    scripts = []
+    for root, dirs, files in os.walk(pathname):
+        dirs.sort()
+        scripts.extend(os.path.join(root, script) for script in sorted(files) if script.endswith(".py"))
+    return sorted(scripts)
 
-def analyze_pathname(pathname):
-    if not pathname:
-        return
-    if os.path.isfile(pathname):
-        return analyze_file(pathname)
-    if os.path.isdir(pathname):
-        scripts = sorted(os.listdir(pathname))
+
+class AnalysisCache:
+    """Sorted diagnostics of already analyzed files, evicted least recently used first."""
+
+    def __init__(self, path, max_entries=DEFAULT_CACHE_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        try:
+            with open(path) as f:
+                self.entries = OrderedDict(json.load(f))
+        except (FileNotFoundError, ValueError):
+            pass
+
+    @staticmethod
+    def key(filename):
+        with open(filename, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        return f"{ANALYZER_VERSION}:{digest}:{filename}"
+
+    def get(self, key, filename):
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return [Diagnostic(filename, *entry) for entry in self.entries[key]]
+
+    def put(self, key, output_list):
+        self.entries[key] = [[d.line, d.code, d.message] for d in output_list]
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def save(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(list(self.entries.items()), f)
+        os.replace(temp_path, self.path)
+
+    def run(self, scripts, check):
+        """Yield the output of every script, calling check() only for files not in the cache."""
+        keys = [self.key(script) for script in scripts]
+        # looked up before any put(), whose evictions could drop a hit before its turn
+        cached = [self.get(key, script) for script, key in zip(scripts, keys)]
+        misses = [script for script, output_list in zip(scripts, cached) if output_list is None]
+        results = iter(check(misses))
+        for key, output_list in zip(keys, cached):
+            if output_list is None:
+                output_list = list(next(results))
+                self.put(key, output_list)
+            yield output_list
+
+
+def run_checks(scripts, workers=1, timings=None):
+    if workers > 1:
+        worker = check_file if timings is None else profile_file
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # map() yields results in submission order, so the output does
+            # not depend on which worker finishes first
+            for result in executor.map(worker, scripts, chunksize=16):
+                if timings is not None:
+                    result, file_timings = result
+                    for code, elapsed in file_timings.items():
+                        timings[code] += elapsed
+                yield result
+    else:
         for script in scripts:
-            script_path = os.path.join(pathname, script)
-            analyze_file(script_path)
+            yield iter_diagnostics(script, timings)
+
+
+def analyze_pathname(pathname, recursive=False, workers=1, timings=None, cache_size=None, reporter=None):
+    if not pathname or not os.path.exists(pathname):
+        return
+    if reporter is None:
+        reporter = TextReporter()
+    scripts = find_scripts(pathname, recursive)
+    root = os.path.dirname(pathname) if os.path.isfile(pathname) else pathname
+
+    if cache_size is None:
+        results = run_checks(scripts, workers, timings)
+    else:
+        cache = AnalysisCache(os.path.join(root, CACHE_FILENAME), cache_size)
+        results = cache.run(scripts, lambda misses: run_checks(misses, workers, timings))
+
+    reporter.start()
+    for output_list in results:
+        for diagnostic in output_list:
+            reporter.report(diagnostic)
+    reporter.finish()
+
+    if cache_size is not None:
+        cache.save()
 
 
 def analyze_file(filename):
-    counter = 0
-    output_list = []
+    for diagnostic in iter_diagnostics(filename):
+        print(diagnostic)
 
-    with open(filename, 'r') as f:
-        code = f.read()
-        try:
-            tree = ast.parse(code)
-        except SyntaxError:
-            pass
-        else:
-            visitor = CodeAnalyzerVisitor(filename, output_list)
-            visitor.visit(tree)
 
-        f.seek(0)
-        for i, line in enumerate(code.splitlines(), start=1):
-            if line == "":
-                counter += 1
-                continue
+class TextReporter:
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def start(self):
+        pass
+
+    def report(self, diagnostic):
+        print(diagnostic, file=self.stream)
+
+    def finish(self):
+        pass
+
+
+class JsonLinesReporter(TextReporter):
+    def report(self, diagnostic):
+        print(json.dumps(diagnostic._asdict()), file=self.stream)
+
+
+class SarifReporter(TextReporter):
+    """Writes a SARIF 2.1.0 log, emitting each result as soon as it is reported."""
+
+    def start(self):
+        driver = {"name": "code_analyzer", "version": ANALYZER_VERSION}
+        header = json.dumps({
+            "version": "2.1.0",
+            "$schema": "https://json.schemastore.org/sarif-2.1.0.json",
+            "runs": [{"tool": {"driver": driver}, "results": []}],
+        })
+        # everything after the opening bracket of the results array is written later
+        self.stream.write(header[:-len("]}]}")])
+        self.separator = ""
+
+    def report(self, diagnostic):
+        result = {
+            "ruleId": diagnostic.code,
+            "level": "warning",
+            "message": {"text": diagnostic.message},
+            "locations": [{"physicalLocation": {
+                "artifactLocation": {"uri": diagnostic.filename},
+                "region": {"startLine": diagnostic.line},
+            }}],
+        }
+        self.stream.write(self.separator + json.dumps(result))
+        self.separator = ","
+
+    def finish(self):
+        self.stream.write("]}]}\n")
+
+
+REPORTERS = {"text": TextReporter, "jsonl": JsonLinesReporter, "sarif": SarifReporter}
+
+
+class LineInfo:
+    """One source line, prepared once and shared by every line rule."""
+
+    def __init__(self, text, blank_lines):
+        self.text = text
+        self.lower = text.lower()
+        self.blank_lines = blank_lines
+
 
-            error_source = f"{filename}: Line {i}:"
+class LineRule:
+    def __init__(self, code, message, check, hint=None):
+        self.code = code
+        self.message = message
+        self.check = check
+        # A rule with a hint cannot fire unless the hint occurs in the
+        # lowercased line, which lets us skip its regexes on most lines.
+        self.hint = hint
 
-            if len(line) > 79:
-                output_list.append(f"{error_source} S001 Too long")
+    def matches(self, line):
+        if self.hint is not None and self.hint not in line.lower:
+            return False
+        return self.check(line)
 
-            if not re.match(r"^( {4})*[^ ]", line):
-                output_list.append(f"{error_source} S002 Indentation is not a multiple of four")
 
-            if not re.search(r'^\s*#', line) and re.search(r"[^#]*;\s*(#.*)?$", line) and not re.search(
-                    r'(["\']).*?;\s*\1', line) and not re.search(r'[^\S;]+\s*;\s*$', line):
-                output_list.append(f"{error_source} S003 Unnecessary semicolon")
+COMMENT_LINE = re.compile(r'^\s*#')
+SEMICOLON = re.compile(r"[^#]*;\s*(#.*)?$")
+QUOTED_SEMICOLON = re.compile(r'(["\']).*?;\s*\1')
+TRAILING_SEMICOLON = re.compile(r'[^\S;]+\s*;\s*$')
+INDENTATION = re.compile(r"^( {4})*[^ ]")
+# Equivalent to the old "[^#]*[^ ]( ?#)" search without its quadratic backtracking
+INLINE_COMMENT = re.compile(r"[^ ] ?#")
+TODO = re.compile(r"(?i)\bTODO\b")
+QUOTED_TODO = re.compile(r'(["\']).*?\\?\bTODO\b.*?\\?\1')
+# Also covers the "\s{3,}" spacing, which this pattern already matches
+CLASS_OR_DEF = re.compile(r"(?i)(class|def)\s+\w+")
 
-            if re.search(r"(?i)[^#]*[^ ]( ?#)", line):
-                output_list.append(f"{error_source} S004 At least two spaces before inline comment required")
 
-            if re.search(r'(?i)(?<!["\']).*?\bTODO\b', line) and not re.search(r'(["\']).*?\\?\bTODO\b.*?\\?\1', line):
-                output_list.append(f"{error_source} S005 TODO found")
+def has_unnecessary_semicolon(line):
+    text = line.text
+    return (not COMMENT_LINE.search(text) and SEMICOLON.search(text) is not None
+            and not QUOTED_SEMICOLON.search(text) and not TRAILING_SEMICOLON.search(text))
 
-            if counter > 2:
-                output_list.append(f"{error_source} S006 More than two blank lines used before this line")
-            counter = 0
 
-            if re.search(r"(?i)(class|def)\s+\w+\s{3,}", line) or re.search(r"(?i)(class|def)\s+\w+\s{0,1}", line):
-                output_list.append(f"{error_source} S007 Too many spaces after 'class' or 'def'")
+def has_todo(line):
+    return TODO.search(line.text) is not None and not QUOTED_TODO.search(line.text)
 
-    flat_list = []
-    for item in output_list:
-        if type(item) == list:
-            flat_list = flat_list + item
+
+def has_class_or_def(line):
+    return "class" in line.lower or "def" in line.lower
+
+
+LINE_RULES = [
+    LineRule("S001", "Too long", lambda line: len(line.text) > 79),
+    LineRule("S002", "Indentation is not a multiple of four", lambda line: not INDENTATION.match(line.text)),
+    LineRule("S003", "Unnecessary semicolon", has_unnecessary_semicolon, hint=";"),
+    LineRule("S004", "At least two spaces before inline comment required",
+             lambda line: INLINE_COMMENT.search(line.text) is not None, hint="#"),
+    LineRule("S005", "TODO found", has_todo, hint="todo"),
+    LineRule("S006", "More than two blank lines used before this line", lambda line: line.blank_lines > 2),
+    LineRule("S007", "Too many spaces after 'class' or 'def'",
+             lambda line: has_class_or_def(line) and CLASS_OR_DEF.search(line.text) is not None),
+]
+
+
+def check_line(filename, lineno, line, timings=None):
+    found = []
+    for rule in LINE_RULES:
+        if timings is None:
+            matched = rule.matches(line)
         else:
-            flat_list.append(item)
+            started = time.perf_counter()
+            matched = rule.matches(line)
+            timings[rule.code] += time.perf_counter() - started
+        if matched:
+            found.append(Diagnostic(filename, lineno, rule.code, rule.message))
+    return found
+
+
+def profile_file(filename):
+    timings = defaultdict(float)
+    return list(iter_diagnostics(filename, timings)), timings
+
+
+def print_timings(timings):
+    total = sum(timings.values())
+    for code, elapsed in sorted(timings.items(), key=lambda item: item[1], reverse=True):
+        share = elapsed / total * 100 if total else 0
+        print(f"{code}: {elapsed:.4f}s ({share:.1f}%)", file=sys.stderr)
+
 
-    for i in sorted(output_list, key=my_digit_sort()):
-        print(i)
+def check_file(filename):
+    return list(iter_diagnostics(filename))
 
 
-def my_digit_sort():
-    rx = re.compile(r'(\d+)|(.)')
-    def key(x):
-        return [(j, int(i)) if i != '' else (j, i)
-                for i, j in rx.findall(x)]
-    return key
+def iter_diagnostics(filename, timings=None):
+    """Yield the diagnostics of a file in line order while its lines are being checked."""
+    with open(filename, 'r') as f:
+        code = f.read()
+
+    tree_diagnostics = []
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        pass
+    else:
+        check_tree(filename, tree, tree_diagnostics)
+    # reversed, so the next diagnostic in line order can be popped from the end
+    tree_diagnostics.sort(reverse=True)
+
+    counter = 0
+    for i, text in enumerate(code.splitlines(), start=1):
+        if text == "":
+            counter += 1
+            continue
+
+        found = check_line(filename, i, LineInfo(text, counter), timings)
+        counter = 0
+        while tree_diagnostics and tree_diagnostics[-1].line <= i:
+            found.append(tree_diagnostics.pop())
+        yield from sorted(found)
+
+    yield from reversed(tree_diagnostics)
 
 
 def main():
-    analyze_pathname(input_path())
+    args = parse_args()
+    if args.benchmark_ast:
+        if args.pathname and os.path.exists(args.pathname):
+            benchmark_ast(find_scripts(args.pathname, args.recursive))
+        return
+    timings = defaultdict(float) if args.timings else None
+    cache_size = args.cache_size if args.cache else None
+    reporter = REPORTERS[args.format]()
+    analyze_pathname(args.pathname, args.recursive, args.workers, timings, cache_size, reporter)
+    if timings is not None:
+        print_timings(timings)
+
+
+if __name__ == "__main__":
+    main()
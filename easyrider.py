@@ -1,4 +1,105 @@
+import os
+import re
 import json
+import sys
+import time
+from argparse import ArgumentParser
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import compress, islice, repeat
+from operator import is_, itemgetter, lt
+
+CHUNK_SIZE = 1 << 16
+BATCH_SIZE = 4096
+
+
+def iter_records(stream, chunk_size=CHUNK_SIZE):
+    """Yield the objects of a JSON array one by one, reading the stream in chunks."""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    started = False
+    while True:
+        chunk = stream.read(chunk_size)
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position == len(buffer):
+                break
+            if not started:
+                if buffer[position] != "[":
+                    raise ValueError("Expected a JSON array of stop records")
+                started = True
+                position += 1
+                continue
+            if buffer[position] == "]":
+                return
+            try:
+                record, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise
+                # the record continues in the next chunk
+                break
+            yield record
+        if not chunk:
+            raise ValueError("Unterminated JSON array")
+
+
+def compile_field(spec):
+    """Turn a field spec into a function counting the invalid values of a whole column.
+
+    The counting is done with list.count, map and compress, so the values are
+    walked in C rather than by a Python loop with a branch per value.
+    """
+    is_char = spec["type"] == "char"
+    expected = str if is_char else spec["type"]
+    required = spec["required"]
+
+    def count_invalid(column):
+        types = list(map(type, column))
+        errors = len(column) - types.count(expected)
+        if required and expected is str:
+            # for other types an empty string is already a type error
+            errors += column.count("")
+        if is_char:
+            strings = compress(column, map(is_, types, repeat(str)))
+            errors += sum(map(lt, repeat(1), map(len, strings)))
+        return errors
+
+    return count_invalid
+
+
+def compile_format(pattern):
+    """Turn a regular expression into a function counting the badly formatted strings of a column.
+
+    Instead of one match call per value, the strings are joined by newlines and
+    scanned once; only strings that are not str, empty (already counted by the
+    type checks) or contain a newline are left to a per-value fallback.
+    """
+    line = re.compile(f"^(?:{pattern})$", re.MULTILINE)
+
+    def count_bad_format(column):
+        strings = list(filter(None, compress(column, map(is_, map(type, column), repeat(str)))))
+        text = "\n".join(strings)
+        if text.count("\n") != max(len(strings) - 1, 0):
+            return sum(1 for value in strings if not line.fullmatch(value))
+        return len(strings) - len(line.findall(text))
+
+    return count_bad_format
+
+
+TIME_PATTERN = "([01][0-9]|2[0-3]):([0-5][0-9])"
+TIME_OR_ANYTHING = re.compile(f"^(?:{TIME_PATTERN}|.*)$", re.MULTILINE)
+
+
+def parse_minutes(column):
+    """Minutes after midnight of every HH:MM value of a column, None for the rest, in one regex scan."""
+    text = "\n".join(value if type(value) is str and "\n" not in value else "" for value in column)
+    return [int(hours) * 60 + int(minutes) if hours else None
+            for hours, minutes in TIME_OR_ANYTHING.findall(text)]
 
 
 class BusCompany:
@@ -12,37 +113,287 @@ class BusCompany:
         "a_time": {"type": str, "required": True}
                             }
 
-    mismatches = dict.fromkeys(data_types_match_dictionary, 0)
+    format_patterns = {
+        "stop_name": "([A-Z][a-z]+ )+(Road|Avenue|Boulevard|Street)",
+        "stop_type": "[SOF]",
+        "a_time": TIME_PATTERN,
+    }
+
+    field_validators = {key: compile_field(spec) for key, spec in data_types_match_dictionary.items()}
+
+    format_validators = {key: compile_format(pattern) for key, pattern in format_patterns.items()}
 
-    def __init__(self, dict_data):
+    def __init__(self, dict_data, check_formats=False):
+        # either a JSON string or an iterable of already decoded stop records
+        if isinstance(dict_data, str):
+            dict_data = json.loads(dict_data)
         self.dict_data = dict_data
-        self.dict_data = json.loads(self.dict_data)
+        self.check_formats = check_formats
+        self.reset()
+
+    def reset(self):
+        self.records = 0
+        self.mismatches = dict.fromkeys(self.data_types_match_dictionary, 0)
+        self.format_mismatches = dict.fromkeys(self.format_patterns, 0)
+
+    @classmethod
+    def from_stream(cls, stream, chunk_size=CHUNK_SIZE, check_formats=False):
+        """Validate records while they are read, without loading the whole feed."""
+        return cls(iter_records(stream, chunk_size), check_formats)
 
     def validate(self):
-        for elem in self.dict_data:
+        self.reset()
+        records = iter(self.dict_data)
+        # checked a batch of records at a time, so streamed feeds stay in constant memory
+        while batch := list(islice(records, BATCH_SIZE)):
+            self.records += len(batch)
+            for key, count_invalid in BusCompany.field_validators.items():
+                try:
+                    column = list(map(itemgetter(key), batch))
+                except KeyError:
+                    column = [elem[key] for elem in batch if key in elem]
+                self.mismatches[key] += count_invalid(column)
+                if self.check_formats and key in BusCompany.format_validators:
+                    self.format_mismatches[key] += BusCompany.format_validators[key](column)
+
+        sum_errors = sum([elem for elem in self.mismatches.values()])
+        return self.mismatches, sum_errors
+
+    def display_output(self):
+        out_dict, error_sum = self.validate()
+        print_report(out_dict, error_sum)
+        if self.check_formats:
+            print_report(self.format_mismatches, sum(self.format_mismatches.values()), "Format validation")
+
+
+def print_report(out_dict, error_sum, title="Type and required fields validation"):
+    print("{}: {} errors".format(title, error_sum))
+    for key, value in out_dict.items():
+        print("{}: {}".format(key, value))
+
+
+def validate_feed(path):
+    with open(path) as stream:
+        company = BusCompany.from_stream(stream)
+        mismatches, _ = company.validate()
+    return mismatches, company.records
+
+
+class ValidationService:
+    """Validates many feeds on a pool of long-lived worker processes.
+
+    Each feed gets its own BusCompany, so its counters never leak into other
+    feeds; the results are added up per operator. A feed that can't be read or
+    parsed is counted as failed, with its error, and the other feeds go on.
+    """
+
+    def __init__(self, workers=None):
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.totals = {}
+
+    def validate(self, feeds):
+        """Validate (operator, path) pairs and return the running totals per operator."""
+        futures = [(operator, path, self.executor.submit(validate_feed, path)) for operator, path in feeds]
+        for operator, path, future in futures:
+            total = self.totals.setdefault(operator, {
+                "feeds": 0,
+                "records": 0,
+                "mismatches": dict.fromkeys(BusCompany.data_types_match_dictionary, 0),
+                "failed": 0,
+                "errors": [],
+            })
+            try:
+                mismatches, records = future.result()
+            except Exception as error:
+                total["failed"] += 1
+                total["errors"].append(f"{path}: {error}")
+                continue
+            total["feeds"] += 1
+            total["records"] += records
+            for key, value in mismatches.items():
+                total["mismatches"][key] += value
+        return self.totals
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def parse_feed(argument):
+    """OPERATOR=FILE, or just FILE for an operator named after the file."""
+    operator, separator, path = argument.partition("=")
+    if not separator:
+        path = argument
+        operator = os.path.splitext(os.path.basename(path))[0]
+    return operator, path
+
+
+class RouteGraph:
+    """Indexes bus lines and stops in one pass over the records.
+
+    Every query afterwards is a dictionary lookup or returns a view that is
+    sorted once and then cached until more records are added.
+    """
+
+    def __init__(self, records=()):
+        self.lines = defaultdict(list)
+        self.stop_names = {}
+        self.next_stops = defaultdict(set)
+        self.lines_by_stop = defaultdict(set)
+        self.stops_by_type = defaultdict(set)
+        self.last_times = {}
+        self.wrong_times = {}
+        self.views = {}
+        records = iter(records)
+        while batch := list(islice(records, BATCH_SIZE)):
+            for record, minutes in zip(batch, parse_minutes(record["a_time"] for record in batch)):
+                self.add(record, minutes)
+
+    def add(self, record, minutes=None):
+        bus_id, stop_id, name = record["bus_id"], record["stop_id"], record["stop_name"]
+        self.lines[bus_id].append(stop_id)
+        self.stop_names[stop_id] = name
+        if record["next_stop"] != 0:
+            self.next_stops[stop_id].add(record["next_stop"])
+        self.lines_by_stop[name].add(bus_id)
+        if record.get("stop_type"):
+            self.stops_by_type[record["stop_type"]].add(name)
+
+        if minutes is None:
+            minutes = parse_minutes([record["a_time"]])[0]
+        # malformed times are the validator's business, they are not compared here
+        if bus_id not in self.wrong_times and minutes is not None:
+            if bus_id in self.last_times and minutes <= self.last_times[bus_id]:
+                self.wrong_times[bus_id] = name
+            self.last_times[bus_id] = minutes
+        self.views.clear()
+
+    def view(self, name, build):
+        if name not in self.views:
+            self.views[name] = build()
+        return self.views[name]
+
+    def stops_per_line(self):
+        return self.view("stops_per_line", lambda: {bus_id: len(stops) for bus_id, stops in self.lines.items()})
+
+    def stops_on_line(self, bus_id):
+        return self.lines.get(bus_id, [])
+
+    def start_stops(self):
+        return self.view("start", lambda: sorted(self.stops_by_type["S"]))
+
+    def finish_stops(self):
+        return self.view("finish", lambda: sorted(self.stops_by_type["F"]))
+
+    def transfer_stops(self):
+        return self.view("transfer", lambda: sorted(
+            name for name, lines in self.lines_by_stop.items() if len(lines) > 1))
+
+    def wrong_time(self, bus_id):
+        """Name of the first stop of the line reached no later than the previous one, or None."""
+        return self.wrong_times.get(bus_id)
+
+    def arrival_times_ok(self):
+        return not self.wrong_times
+
+    def display_output(self):
+        print("Line names and number of stops:")
+        for bus_id, stops in self.stops_per_line().items():
+            print(f"bus_id: {bus_id}, stops: {stops}")
+        print(f"Start stops: {len(self.start_stops())} {self.start_stops()}")
+        print(f"Transfer stops: {len(self.transfer_stops())} {self.transfer_stops()}")
+        print(f"Finish stops: {len(self.finish_stops())} {self.finish_stops()}")
+        print("Arrival time test:")
+        for bus_id, name in self.wrong_times.items():
+            print(f"bus_id line {bus_id}: wrong time on station {name}")
+        if self.arrival_times_ok():
+            print("OK")
+
+
+def benchmark_validate(count):
+    def validate_with_lookups(records):
+        # the per-value dictionary lookups BusCompany.validate used before
+        spec = BusCompany.data_types_match_dictionary
+        mismatches = dict.fromkeys(spec, 0)
+        for elem in records:
             for key, value in elem.items():
-                if value == "" and BusCompany.data_types_match_dictionary[key]["required"] == True:
-                    BusCompany.mismatches[key] += 1
+                if value == "" and spec[key]["required"] == True:
+                    mismatches[key] += 1
                 else:
-                    if type(value) != BusCompany.data_types_match_dictionary[key]["type"]:
-                        if BusCompany.data_types_match_dictionary[key]["type"] != "char":
-                            BusCompany.mismatches[key] += 1
+                    if type(value) != spec[key]["type"]:
+                        if spec[key]["type"] != "char":
+                            mismatches[key] += 1
                         else:
                             if type(value) != str:
-                                BusCompany.mismatches[key] += 1
+                                mismatches[key] += 1
                             elif len(value) > 1:
-                                BusCompany.mismatches[key] += 1
+                                mismatches[key] += 1
+        return mismatches
 
-        sum_errors = sum([elem for elem in BusCompany.mismatches.values()])
-        return BusCompany.mismatches, sum_errors
+    def validate_compiled(records):
+        return BusCompany(records).validate()[0]
+
+    samples = [
+        {"bus_id": 128, "stop_id": 1, "stop_name": "Prospekt Avenue", "next_stop": 3, "stop_type": "S", "a_time": "08:12"},
+        {"bus_id": "", "stop_id": "7", "stop_name": "", "next_stop": 0, "stop_type": "FF", "a_time": 8.19},
+        {"bus_id": 256, "stop_id": 6, "stop_name": "Sunset Boulevard", "next_stop": "0", "stop_type": "", "a_time": ""},
+    ]
+    records = [samples[i % len(samples)] for i in range(count)]
+    results = []
+    for name, validate in [
+        ("dictionary lookups", validate_with_lookups),
+        ("compiled column checks", validate_compiled),
+        ("column checks with formats", lambda records: BusCompany(records, check_formats=True).validate()[0]),
+    ]:
+        started = time.perf_counter()
+        results.append(validate(records))
+        elapsed = time.perf_counter() - started
+        print(f"{name}: {count} records in {elapsed:.3f}s ({count / elapsed:.0f} records/s)")
+    assert results[0] == results[1] == results[2]
 
-    def display_output(self):
-        out_dict, error_sum = self.validate()
-        print("Type and required fields validation: {} errors".format(error_sum))
-        for key, value in out_dict.items():
-            print("{}: {}".format(key, value))
 
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--stream", metavar="FILE",
+                        help="read the feed incrementally from FILE ('-' for stdin) instead of one input line")
+    parser.add_argument("--benchmark", type=int, metavar="N", help="time validating N in-memory records")
+    parser.add_argument("--feeds", nargs="+", metavar="[OPERATOR=]FILE",
+                        help="validate many feeds in parallel and report the errors per operator")
+    parser.add_argument("--workers", type=int, help="number of worker processes for --feeds")
+    parser.add_argument("--formats", action="store_true",
+                        help="also report stop_name, stop_type and a_time format errors")
+    parser.add_argument("--routes", action="store_true",
+                        help="report lines, start/transfer/finish stops and arrival times instead of type errors")
+    args = parser.parse_args()
 
-input_dictionary = input()
-EasyRider = BusCompany(input_dictionary)
-EasyRider.display_output()
+    if args.benchmark:
+        benchmark_validate(args.benchmark)
+    elif args.feeds:
+        service = ValidationService(args.workers)
+        try:
+            totals = service.validate(parse_feed(feed) for feed in args.feeds)
+        finally:
+            service.close()
+        for operator, total in totals.items():
+            print(f"{operator}: {total['feeds']} feeds, {total['records']} records, {total['failed']} failed")
+            for error in total["errors"]:
+                print(f"Failed feed {error}")
+            print_report(total["mismatches"], sum(total["mismatches"].values()))
+    elif args.routes:
+        if args.stream is None:
+            RouteGraph(json.loads(input())).display_output()
+        else:
+            with sys.stdin if args.stream == "-" else open(args.stream) as stream:
+                RouteGraph(iter_records(stream)).display_output()
+    elif args.stream is None:
+        input_dictionary = input()
+        EasyRider = BusCompany(input_dictionary, args.formats)
+        EasyRider.display_output()
+    else:
+        stream = sys.stdin if args.stream == "-" else open(args.stream)
+        with stream:
+            EasyRider = BusCompany.from_stream(stream, check_formats=args.formats)
+            started = time.perf_counter()
+            EasyRider.display_output()
+            elapsed = time.perf_counter() - started
+        print(f"{EasyRider.records} records in {elapsed:.2f}s "
+              f"({EasyRider.records / elapsed:.0f} records/s)", file=sys.stderr)
@@ -1,43 +1,369 @@
+import gzip
 import json
+import os
 import sys
+import tracemalloc
 from argparse import ArgumentParser
-from dataclasses import asdict, dataclass
+from collections import defaultdict, deque
+from contextlib import redirect_stdout
+from dataclasses import asdict, dataclass, fields, make_dataclass
+from heapq import heappop, heappush
 from io import StringIO
+from itertools import chain
 from pathlib import Path
-from random import choices
-from shutil import copyfileobj
-from typing import Callable
+from queue import SimpleQueue
+from random import choices, randrange, sample
+from tempfile import TemporaryDirectory
+from threading import Thread
+from time import perf_counter
+from typing import Callable, Iterable, Iterator
 
 
-log_file: StringIO = StringIO()
+class RotatingLogWriter:
+    """Appends log lines to a file from a background thread, rotating it by size.
+
+    Lines are queued by the interactive thread and written in batches, so the
+    prompts never wait on the disk. Once the file would grow past max_bytes it
+    is renamed to file.1 (file.1 to file.2 and so on, up to backups); a line
+    longer than max_bytes gets a file of its own.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 2 ** 20, backups: int = 3, max_batch: int = 1024) -> None:
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.max_batch = max_batch
+        self.queue = SimpleQueue()
+        self.file = self.path.open(mode="a", encoding="utf-8")
+        self.size = self.file.tell()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, line: str) -> None:
+        self.queue.put(line)
+
+    def run(self) -> None:
+        while (line := self.queue.get()) is not None:
+            batch = [line]
+            while len(batch) < self.max_batch and not self.queue.empty():
+                if (line := self.queue.get()) is None:
+                    self.flush(batch)
+                    return
+                batch.append(line)
+            self.flush(batch)
+
+    def flush(self, batch: list[str]) -> None:
+        # the size is checked line by line, so a large batch can't carry the file past max_bytes
+        chunk = []
+        for line in batch:
+            size = len(line.encode("utf-8"))
+            if self.size and self.size + size > self.max_bytes:
+                self.file.writelines(chunk)
+                chunk = []
+                self.rotate()
+            chunk.append(line)
+            self.size += size
+        self.file.writelines(chunk)
+        self.file.flush()
+
+    def rotate(self) -> None:
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            older = self.path.with_name(f"{self.path.name}.{i}")
+            if older.exists():
+                older.replace(self.path.with_name(f"{self.path.name}.{i + 1}"))
+        if self.backups:
+            self.path.replace(self.path.with_name(f"{self.path.name}.1"))
+        self.file = self.path.open(mode="w", encoding="utf-8")
+        self.size = 0
+
+    def close(self) -> None:
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+
+
+class SessionLog:
+    """Keeps the last max_lines lines of the session and passes every line on to an optional sink."""
+
+    def __init__(self, max_lines: int = 10_000, sink: RotatingLogWriter or None = None) -> None:
+        self.lines = deque(maxlen=max_lines)
+        self.sink = sink
+
+    def write(self, line: str) -> None:
+        self.lines.append(line)
+        if self.sink is not None:
+            self.sink.write(line)
+
+    def dump(self, file) -> None:
+        file.writelines(self.lines)
+
+    def close(self) -> None:
+        if self.sink is not None:
+            self.sink.close()
+            self.sink = None
+
+
+session_log: SessionLog = SessionLog()
 
 
 def print_and_log(text: object = "") -> None:
-    print(text, file=log_file)
-    print(text)
+    line = f"{text}\n"
+    session_log.write(line)
+    sys.stdout.write(line)
 
 
 def input_and_log(prompt: object = "") -> str:
     user_input = input(prompt)
-    print(prompt, user_input, sep="", file=log_file)
+    session_log.write(f"{prompt}{user_input}\n")
     return user_input
 
 
-@dataclass
+@dataclass(slots=True)
 class Card:
     term: str
     definition: str
     errors: int
 
 
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def open_deck(file_name: str, mode: str):
+    """Open a deck file as text, through gzip when it is (or should be) compressed."""
+    path = Path(file_name)
+    if mode == "r":
+        with path.open("rb") as file:
+            compressed = file.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+    else:
+        compressed = path.suffix == ".gz"
+    if compressed:
+        return gzip.open(path, f"{mode}t", encoding="utf-8")
+    return path.open(mode, encoding="utf-8")
+
+
+def iter_json_array(file, chunk_size: int = 1 << 16) -> Iterator[object]:
+    """Yield the items of a JSON array whose "[" was already read, reading the file in chunks."""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    while True:
+        chunk = file.read(chunk_size)
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position == len(buffer):
+                break
+            if buffer[position] == "]":
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise
+                # the item continues in the next chunk
+                break
+            yield item
+        if not chunk:
+            raise ValueError("The JSON array of the deck is not closed")
+
+
+def read_deck(file_name: str) -> Iterator[Card]:
+    """Yield the cards of a deck one by one, from JSON Lines or an older JSON array."""
+    with open_deck(file_name, "r") as file:
+        # only up to the first non-blank character is read to tell the formats apart
+        lead = ""
+        while (char := file.read(1)).isspace():
+            lead += char
+        if char == "[":
+            yield from (Card(**card) for card in iter_json_array(file))
+            return
+        for line in chain([lead + char + file.readline()], file):
+            if line.strip():
+                yield Card(**json.loads(line))
+
+
+def write_deck(file_name: str, cards: Iterable[Card]) -> None:
+    """Write the cards one by one, as JSON Lines for .jsonl(.gz) files and as a JSON array otherwise."""
+    json_lines = ".jsonl" in Path(file_name).suffixes
+    # a plain dict per card, since asdict() deep-copies every field
+    encoded = (
+        json.dumps({"term": card.term, "definition": card.definition, "errors": card.errors})
+        for card in cards
+    )
+    with open_deck(file_name, "w") as file:
+        if json_lines:
+            file.writelines(f"{line}\n" for line in encoded)
+        else:
+            file.write("[")
+            file.write(next(encoded, ""))
+            file.writelines(f", {line}" for line in encoded)
+            file.write("]")
+
+
+class ReviewScheduler:
+    """Picks cards with probability proportional to errors + 1 and keeps the hardest ones at hand.
+
+    The weights live in a Fenwick tree over card slots, so picking a card and
+    changing its weight are O(log n). Cards with errors are grouped by their
+    error count, and a heap of the counts finds the largest group in O(log n).
+    """
+
+    slots: list[Card | None]
+    positions: dict[str, int]
+    tree: list[int]
+    by_errors: dict[int, dict[str, Card]]
+    error_counts: list[int]
+
+    def __init__(self, cards: Iterable[Card] = ()) -> None:
+        self.slots = list(cards)
+        self.positions = {card.term: i for i, card in enumerate(self.slots)}
+        self.free = []
+        # 1-based Fenwick tree, built bottom-up in O(n)
+        self.tree = [0] + [card.errors + 1 for card in self.slots]
+        self.total = sum(self.tree)
+        for i in range(1, len(self.tree)):
+            parent = i + (i & -i)
+            if parent < len(self.tree):
+                self.tree[parent] += self.tree[i]
+        self.by_errors = defaultdict(dict)
+        self.error_counts = []
+        for card in self.slots:
+            if card.errors > 0:
+                self.group(card)
+
+    def weight_of(self, card: Card | None) -> int:
+        return 0 if card is None else card.errors + 1
+
+    def prefix(self, i: int) -> int:
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def change(self, position: int, delta: int) -> None:
+        self.total += delta
+        i = position + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def group(self, card: Card) -> None:
+        bucket = self.by_errors[card.errors]
+        if not bucket:
+            heappush(self.error_counts, -card.errors)
+        bucket[card.term] = card
+
+    def ungroup(self, card: Card, errors: int) -> None:
+        if errors > 0:
+            bucket = self.by_errors[errors]
+            del bucket[card.term]
+            if not bucket:
+                # the stale count is dropped from the heap by hardest()
+                del self.by_errors[errors]
+
+    def add(self, card: Card) -> None:
+        if self.free:
+            position = self.free.pop()
+            self.slots[position] = card
+            self.change(position, self.weight_of(card))
+        else:
+            position = len(self.slots)
+            self.slots.append(card)
+            # a new last node covers the slots (position - lowbit, position]
+            i = position + 1
+            self.tree.append(self.weight_of(card) + self.prefix(i - 1) - self.prefix(i - (i & -i)))
+            self.total += self.weight_of(card)
+        self.positions[card.term] = position
+        if card.errors > 0:
+            self.group(card)
+
+    def remove(self, card: Card) -> None:
+        position = self.positions.pop(card.term)
+        self.change(position, -self.weight_of(card))
+        self.slots[position] = None
+        self.free.append(position)
+        self.ungroup(card, card.errors)
+
+    def record_error(self, card: Card) -> None:
+        self.ungroup(card, card.errors)
+        card.errors += 1
+        self.change(self.positions[card.term], 1)
+        self.group(card)
+
+    def pick(self) -> Card:
+        target = randrange(self.total)
+        position = 0
+        step = 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            following = position + step
+            if following < len(self.tree) and self.tree[following] <= target:
+                position = following
+                target -= self.tree[following]
+            step >>= 1
+        return self.slots[position]
+
+    def hardest(self) -> list[Card]:
+        while self.error_counts and -self.error_counts[0] not in self.by_errors:
+            heappop(self.error_counts)
+        if not self.error_counts:
+            return []
+        return sorted(self.by_errors[-self.error_counts[0]].values(), key=lambda card: self.positions[card.term])
+
+
 class Controller:
     import_from: str or None
     export_to: str or None
-    cards: dict[str, Card] = {}
+    cards: dict[str, Card]
+    terms_by_definition: dict[str, str]
+    shared_definitions: set[str]
+    scheduler: ReviewScheduler
 
     def __init__(self, **kwargs) -> None:
         self.import_from = kwargs.get("import_from")
         self.export_to = kwargs.get("export_to")
+        self.load_deck(())
+
+    def load_deck(self, cards) -> None:
+        """Replace the deck and rebuild the definition -> term index."""
+        deck = {}
+        terms_by_definition = {}
+        # only an imported file can give several cards the same definition
+        shared_definitions = set()
+        for card in cards:
+            deck[card.term] = card
+        for card in deck.values():
+            if card.definition in terms_by_definition:
+                shared_definitions.add(card.definition)
+            else:
+                terms_by_definition[card.definition] = card.term
+        # assigned last, so a deck that fails to load leaves the current one untouched
+        self.cards = deck
+        self.terms_by_definition = terms_by_definition
+        self.shared_definitions = shared_definitions
+        self.scheduler = ReviewScheduler(deck.values())
+
+    def store_card(self, card: Card) -> None:
+        self.cards[card.term] = card
+        self.terms_by_definition.setdefault(card.definition, card.term)
+        self.scheduler.add(card)
+
+    def discard_card(self, term: str) -> None:
+        card = self.cards.pop(term)
+        self.scheduler.remove(card)
+        if self.terms_by_definition.get(card.definition) != term:
+            return
+        del self.terms_by_definition[card.definition]
+        if card.definition in self.shared_definitions:
+            for other in self.cards.values():
+                if other.definition == card.definition:
+                    self.terms_by_definition[card.definition] = other.term
+                    break
+            else:
+                self.shared_definitions.discard(card.definition)
 
     def start(self) -> None:
         if self.import_from is not None:
@@ -67,17 +393,17 @@ class Controller:
             term = input_and_log(f'The card "{term}" already exists. Try again:\n')
 
         definition = input_and_log("The definition of the card:\n")
-        while definition in [card.definition for card in self.cards.values()]:
+        while definition in self.terms_by_definition:
             definition = input_and_log(f'The definition "{definition}" already exists. Try again:\n')
 
         print_and_log(f'The pair ("{term}":"{definition}") has been added.')
-        self.cards[term] = Card(term, definition, 0)
+        self.store_card(Card(term, definition, 0))
 
     def remove_cards(self) -> None:
         term = input_and_log("Which card?\n")
         if term in self.cards.keys():
             print_and_log("The card has been removed.")
-            del self.cards[term]
+            self.discard_card(term)
         else:
             print_and_log(f'Can\'t remove "{term}": there is no such card.')
 
@@ -85,29 +411,24 @@ class Controller:
         if file_name is None:
             file_name = input_and_log("File name:\n")
         try:
-            cards = json.loads(Path(file_name).read_text())
+            self.load_deck(read_deck(file_name))
         except FileNotFoundError:
             print_and_log(f'File "{file_name}" not found.')
         else:
-            self.cards = {card["term"]: Card(**card) for card in cards}
             print_and_log(f"{len(self.cards)} cards have been loaded.")
 
     def export_cards(self, file_name: str or None = None) -> None:
         if file_name is None:
             file_name = input_and_log("File name:\n")
-        Path(file_name).write_text(
-            json.dumps([asdict(card) for card in self.cards.values()])
-        )
+        write_deck(file_name, self.cards.values())
         print_and_log(f"{len(self.cards)} cards have been saved.")
 
     def ask_cards(self) -> None:
         def wrong(answer_def, correct_def) -> str:
-            if existing := list(
-                filter(lambda x: x.definition == answer_def, self.cards.values())
-            ):
+            if (existing := self.terms_by_definition.get(answer_def)) is not None:
                 msg = [
                     f'Wrong. The right answer is "{correct_def}", ',
-                    f'but your definition is correct for "{existing[0].term}".',
+                    f'but your definition is correct for "{existing}".',
                 ]
             else:
                 msg = [f'Wrong. The right answer is "{correct_def}".']
@@ -115,18 +436,17 @@ class Controller:
 
         times_to_ask = int(input_and_log("How many times to ask?\n"))
 
-        for card in choices(list(self.cards.values()), k=times_to_ask):
+        for _ in range(times_to_ask if self.cards else 0):
+            card = self.scheduler.pick()
             answer = input_and_log(f'Print the definition of "{card.term}":\n')
             if answer == card.definition:
                 print_and_log("Correct!")
             else:
                 print_and_log(wrong(answer, card.definition))
-                card.errors += 1
+                self.scheduler.record_error(card)
 
     def hardest_card(self) -> None:
-        if with_errors := list(filter(lambda x: x.errors > 0, self.cards.values())):
-            hardest = sorted(with_errors, key=lambda x: x.errors, reverse=True)
-            top = [card for card in hardest if card.errors == hardest[0].errors]
+        if top := self.scheduler.hardest():
             if len(top) > 1:
                 msg = [
                     "The hardest cards are ",
@@ -136,8 +456,8 @@ class Controller:
             else:
                 msg = [
                     "The hardest card is ",
-                    f'"{hardest[0].term}". ',
-                    f"You have {hardest[0].errors} errors answering it.",
+                    f'"{top[0].term}". ',
+                    f"You have {top[0].errors} errors answering it.",
                 ]
             print_and_log("".join(msg))
         else:
@@ -146,6 +466,7 @@ class Controller:
     def reset_stats(self) -> None:
         for card in self.cards.values():
             card.errors = 0
+        self.scheduler = ReviewScheduler(self.cards.values())
         print_and_log("Card statistics have been reset.")
 
     def exit(self) -> None:
@@ -158,15 +479,174 @@ class Controller:
     def log() -> None:
         file_name = input_and_log("File name:\n")
         with Path(file_name).open(mode="a") as file:
-            log_file.seek(0)
-            copyfileobj(log_file, file)
+            session_log.dump(file)
         print_and_log("The log has been saved.")
 
 
+def benchmark_lookups(count: int, probes: int = 100) -> None:
+    controller = Controller()
+    controller.load_deck(Card(f"term {i}", f"definition {i}", 0) for i in range(count))
+    # half of the probed definitions are in the deck
+    definitions = [f"definition {i}" for i in sample(range(count * 2), probes)]
+    cards = controller.cards.values()
+
+    lookups: dict[str, Callable] = {
+        "duplicate check, list of definitions": lambda d: d in [card.definition for card in cards],
+        "duplicate check, index": lambda d: d in controller.terms_by_definition,
+        "wrong answer, filter": lambda d: list(filter(lambda x: x.definition == d, cards)),
+        "wrong answer, index": lambda d: controller.terms_by_definition.get(d),
+    }
+    for name, lookup in lookups.items():
+        started = perf_counter()
+        for definition in definitions:
+            lookup(definition)
+        elapsed = perf_counter() - started
+        print(f"{name}: {elapsed / probes * 1e6:.2f} us per lookup in {count} cards")
+
+
+def benchmark_memory(count: int) -> None:
+    # the same fields as Card, but with a __dict__ per instance like before
+    dict_card = make_dataclass("DictCard", [(field.name, field.type) for field in fields(Card)])
+    for name, card_type in [("__dict__ cards", dict_card), ("__slots__ cards", Card)]:
+        terms = [f"term {i}" for i in range(count)]
+        definitions = [f"definition {i}" for i in range(count)]
+        tracemalloc.start()
+        deck = {term: card_type(term, definition, 0) for term, definition in zip(terms, definitions)}
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"{name}: {size / 2 ** 20:.1f} MiB for {len(deck)} cards ({size / count:.0f} bytes per card)")
+
+
+def benchmark_io(count: int) -> None:
+    cards = [Card(f"term {i}", f"definition {i}", i % 5) for i in range(count)]
+    with TemporaryDirectory() as directory:
+        whole = Path(directory, "whole.json")
+        runs: dict[str, Callable] = {
+            "export .json as one string": lambda: whole.write_text(json.dumps([asdict(card) for card in cards])),
+            "import .json as one string": lambda: {c["term"]: Card(**c) for c in json.loads(whole.read_text())},
+        }
+        for name in ("deck.json", "deck.jsonl", "deck.jsonl.gz"):
+            path = str(Path(directory, name))
+            runs[f"export {name}"] = lambda path=path: write_deck(path, cards)
+            runs[f"import {name}"] = lambda path=path: {card.term: card for card in read_deck(path)}
+
+        for name, run in runs.items():
+            started = perf_counter()
+            run()
+            elapsed = perf_counter() - started
+            # a second, traced run, since tracing slows the first one down
+            tracemalloc.start()
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{name}: {elapsed:.2f}s, peak memory {peak / 2 ** 20:.1f} MiB")
+
+
+def benchmark_review(count: int, rounds: int = 1000) -> None:
+    cards = [Card(f"term {i}", f"definition {i}", i % 5) for i in range(count)]
+    deck = {card.term: card for card in cards}
+    # its own copies, since the list runs change errors behind the scheduler's back
+    scheduler = ReviewScheduler(Card(card.term, card.definition, card.errors) for card in cards)
+
+    def pick_by_list() -> None:
+        choices(list(deck.values()))[0].errors += 1
+
+    def hardest_by_sort() -> None:
+        hardest = sorted(filter(lambda x: x.errors > 0, deck.values()), key=lambda x: x.errors, reverse=True)
+        [card for card in hardest if card.errors == hardest[0].errors]
+
+    def pick_by_scheduler() -> None:
+        scheduler.record_error(scheduler.pick())
+
+    runs: dict[str, Callable] = {
+        "pick with list + choices": pick_by_list,
+        "pick with scheduler": pick_by_scheduler,
+        "hardest with filter + sort": hardest_by_sort,
+        "hardest with scheduler": scheduler.hardest,
+    }
+    for name, run in runs.items():
+        started = perf_counter()
+        for _ in range(rounds):
+            run()
+        elapsed = perf_counter() - started
+        print(f"{name}: {elapsed / rounds * 1e6:.1f} us per call")
+
+
+def benchmark_log(count: int) -> None:
+    def unbounded() -> StringIO:
+        log_file = StringIO()
+        for i in range(count):
+            print(f"line {i}", file=log_file)
+            print(f"line {i}")
+        return log_file
+
+    def bounded() -> SessionLog:
+        log = SessionLog()
+        for i in range(count):
+            line = f"line {i}\n"
+            log.write(line)
+            sys.stdout.write(line)
+        return log
+
+    def written() -> SessionLog:
+        with TemporaryDirectory() as directory:
+            log = SessionLog(sink=RotatingLogWriter(str(Path(directory, "session.log"))))
+            for i in range(count):
+                line = f"line {i}\n"
+                log.write(line)
+                sys.stdout.write(line)
+            log.close()
+        return log
+
+    runs: dict[str, Callable] = {
+        "unbounded StringIO": unbounded,
+        "ring buffer": bounded,
+        "ring buffer + background writer": written,
+    }
+    with open(os.devnull, "w") as devnull:
+        for name, run in runs.items():
+            tracemalloc.start()
+            started = perf_counter()
+            with redirect_stdout(devnull):
+                log = run()
+            elapsed = perf_counter() - started
+            size = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            del log
+            print(f"{name}: {elapsed:.2f}s, {size / 2 ** 20:.1f} MiB kept")
+
+
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--import_from")
     parser.add_argument("--export_to")
+    parser.add_argument("--log_lines", type=int, default=10_000, help="lines of the session kept for the log action")
+    parser.add_argument("--log_to", help="also append the session to this file in the background")
+    parser.add_argument("--log_max_bytes", type=int, default=2 ** 20, help="rotate the --log_to file past this size")
+    parser.add_argument("--log_backups", type=int, default=3, help="rotated --log_to files to keep")
+    parser.add_argument("--benchmark", type=int, metavar="N", help="time definition lookups in a deck of N cards")
+    parser.add_argument("--benchmark-io", type=int, metavar="N", help="time importing and exporting N cards")
+    parser.add_argument("--benchmark-memory", type=int, metavar="N", help="measure the memory of a deck of N cards")
+    parser.add_argument("--benchmark-log", type=int, metavar="N", help="time logging N lines")
+    parser.add_argument("--benchmark-review", type=int, metavar="N", help="time picking and ranking cards in a deck of N cards")
     args = parser.parse_args()
 
-    Controller(**vars(args)).start()
+    if args.benchmark:
+        benchmark_lookups(args.benchmark)
+    elif args.benchmark_io:
+        benchmark_io(args.benchmark_io)
+    elif args.benchmark_memory:
+        benchmark_memory(args.benchmark_memory)
+    elif args.benchmark_review:
+        benchmark_review(args.benchmark_review)
+    elif args.benchmark_log:
+        benchmark_log(args.benchmark_log)
+    else:
+        sink = None
+        if args.log_to is not None:
+            sink = RotatingLogWriter(args.log_to, args.log_max_bytes, args.log_backups)
+        session_log = SessionLog(args.log_lines, sink)
+        try:
+            Controller(import_from=args.import_from, export_to=args.export_to).start()
+        finally:
+            session_log.close()
@@ -1,4 +1,15 @@
-from sqlalchemy import create_engine, Column, String, Integer, Float
+import csv
+import os
+from argparse import ArgumentParser
+from itertools import islice
+from pathlib import Path
+from random import choices, random
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from sqlalchemy import (create_engine, Column, String, Integer, Float, delete, event, func, insert, inspect,
+                        literal_column, select, text, update)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -27,14 +38,268 @@ class Financial(Base):
     liabilities = Column(Float)
 
 
-# Connect to the database
-engine = create_engine('sqlite:////Users/sheparl/Documents/Calculator for Investors/Calculator for Investors/investor.db')
-Session = sessionmaker(bind=engine)
-session = Session()
+class Indicator(Base):
+    """Financial indicators of a ticker, kept in step with its Financial row by the triggers below."""
+    __tablename__ = 'indicators'
+    ticker = Column(String, primary_key=True)
+    p_e = Column(Float)
+    p_s = Column(Float)
+    p_b = Column(Float)
+    nd_ebitda = Column(Float, index=True)
+    roe = Column(Float, index=True)
+    roa = Column(Float, index=True)
+    l_a = Column(Float)
+
+
+def ratio(numerator, denominator):
+    # NULLIF turns a zero denominator into NULL, like the None the Python code used to return
+    return numerator.op("/", return_type=Float)(func.nullif(denominator, literal_column("0")))
+
+
+# How each Indicator column is computed from Financial
+INDICATORS = {
+    "p_e": ratio(Financial.market_price, Financial.net_profit),
+    "p_s": ratio(Financial.market_price, Financial.sales),
+    "p_b": ratio(Financial.market_price, Financial.assets),
+    "nd_ebitda": ratio(Financial.net_debt, Financial.ebitda),
+    "roe": ratio(Financial.net_profit, Financial.equity),
+    "roa": ratio(Financial.net_profit, Financial.assets),
+    "l_a": ratio(Financial.liabilities, Financial.assets),
+}
+
+# Ranked indicators of the TOP TEN MENU, by option
+TOP_TEN = {
+    1: ("ND/EBITDA", Indicator.nd_ebitda),
+    2: ("ROE", Indicator.roe),
+    3: ("ROA", Indicator.roa),
+}
+
+
+def refresh_indicators(where=None):
+    """Return an INSERT OR REPLACE of the indicators of the Financial rows matching where (all by default)."""
+    query = select(Financial.ticker, *INDICATORS.values())
+    if where is not None:
+        query = query.where(where)
+    return insert(Indicator).prefix_with("OR REPLACE").from_select(["ticker", *INDICATORS], query)
+
+
+def create_indicator_triggers(connection):
+    refresh = refresh_indicators(Financial.ticker == literal_column("NEW.ticker")).compile(connection)
+    forget = "DELETE FROM indicators WHERE ticker = OLD.ticker"
+    triggers = {
+        "financial_indicators_insert": f"AFTER INSERT ON financial BEGIN {refresh}; END",
+        "financial_indicators_update": f"AFTER UPDATE ON financial BEGIN {forget}; {refresh}; END",
+        "financial_indicators_delete": f"AFTER DELETE ON financial BEGIN {forget}; END",
+    }
+    for name, trigger in triggers.items():
+        connection.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS {name} {trigger}")
+
+
+def drop_indicator_triggers(connection):
+    for name in ("insert", "update", "delete"):
+        connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS financial_indicators_{name}")
+
+
+def rebuild_indicators(connection):
+    """Recompute every indicator, e.g. after loading financials with the triggers dropped."""
+    connection.execute(delete(Indicator))
+    connection.execute(refresh_indicators())
+
+
+# A trigram full-text index over company names. It answers the same substring
+# matches as LIKE '%...%' without scanning companies. The index is keyed on the
+# companies rowid, which VACUUM may renumber, so rebuild it after one.
+SEARCH_TABLE = "company_search"
+SEARCH_TRIGGERS = {
+    "companies_search_insert": f"AFTER INSERT ON companies BEGIN "
+                               f"INSERT INTO {SEARCH_TABLE}(rowid, name) VALUES (NEW.rowid, NEW.name); END",
+    "companies_search_update": f"AFTER UPDATE OF name ON companies BEGIN "
+                               f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, name) "
+                               f"VALUES ('delete', OLD.rowid, OLD.name); "
+                               f"INSERT INTO {SEARCH_TABLE}(rowid, name) VALUES (NEW.rowid, NEW.name); END",
+    "companies_search_delete": f"AFTER DELETE ON companies BEGIN "
+                               f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, name) "
+                               f"VALUES ('delete', OLD.rowid, OLD.name); END",
+}
+SEARCH_QUERY = text(
+    f"SELECT companies.* FROM {SEARCH_TABLE} JOIN companies ON companies.rowid = {SEARCH_TABLE}.rowid "
+    f"WHERE {SEARCH_TABLE} MATCH :query ORDER BY companies.name LIKE :prefix DESC, companies.name"
+)
+
+
+def create_search(connection):
+    connection.exec_driver_sql(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+        f"USING fts5(name, content='companies', content_rowid='rowid', tokenize='trigram')"
+    )
+    for name, trigger in SEARCH_TRIGGERS.items():
+        connection.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS {name} {trigger}")
+
+
+def rebuild_search(connection):
+    connection.exec_driver_sql(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')")
+
+
+def create_schema(engine):
+    with engine.begin() as connection:
+        materialized = inspect(connection).has_table(Indicator.__tablename__)
+        indexed = inspect(connection).has_table(SEARCH_TABLE)
+        Base.metadata.create_all(connection)
+        # the expression indexes the rankings used before the indicators table
+        for name in ("nd_ebitda", "roe", "roa"):
+            connection.exec_driver_sql(f"DROP INDEX IF EXISTS ix_financial_{name}")
+        create_indicator_triggers(connection)
+        create_search(connection)
+        if not materialized:
+            rebuild_indicators(connection)
+        if not indexed:
+            rebuild_search(connection)
+
+
+FINANCIAL_COLUMNS = ("ebitda", "sales", "net_profit", "market_price", "net_debt", "assets", "equity",
+                     "cash_equivalents", "liabilities")
+
+
+def upsert(model, columns):
+    statement = sqlite_insert(model)
+    return statement.on_conflict_do_update(
+        index_elements=["ticker"], set_={column: statement.excluded[column] for column in columns}
+    )
+
+
+def import_csv(path, connection, batch_size=1000):
+    """Upsert the companies and/or financials of a CSV with a ticker column and return the number of rows.
+
+    The CSV is read in batches, and each batch is one executemany per table, so
+    the whole file loads in the caller's transaction. Instead of a trigger run per
+    row, the indicators are refreshed once per batch.
+    """
+    rows = 0
+    with open(path, newline="") as file:
+        reader = csv.DictReader(file)
+        header = reader.fieldnames or []
+        if "ticker" not in header:
+            raise ValueError(f"{path} has no ticker column")
+        company_columns = [column for column in ("name", "sector") if column in header]
+        financial_columns = [column for column in FINANCIAL_COLUMNS if column in header]
+        drop_indicator_triggers(connection)
+        while batch := list(islice(reader, batch_size)):
+            if company_columns:
+                connection.execute(upsert(Company, company_columns), [
+                    {"ticker": row["ticker"]} | {column: row[column] or None for column in company_columns}
+                    for row in batch
+                ])
+            if financial_columns:
+                connection.execute(upsert(Financial, financial_columns), [
+                    {"ticker": row["ticker"]}
+                    | {column: float(row[column]) if row[column] else None for column in financial_columns}
+                    for row in batch
+                ])
+                connection.execute(refresh_indicators(Financial.ticker.in_([row["ticker"] for row in batch])))
+            rows += len(batch)
+        create_indicator_triggers(connection)
+    return rows
+
+
+# The database, e.g. sqlite:////path/to/investor.db, and the connections kept open to it
+DATABASE_URL = os.environ.get("INVESTOR_DATABASE_URL", "sqlite:///investor.db")
+POOL_SIZE = int(os.environ.get("INVESTOR_POOL_SIZE", "5"))
+# Set on every new SQLite connection: in WAL mode reads don't wait for the writer and
+# synchronous=NORMAL only syncs at checkpoints, and mmap saves copying pages on reads
+SQLITE_PRAGMAS = ("journal_mode=WAL", "synchronous=NORMAL", f"mmap_size={256 * 2 ** 20}", "busy_timeout=5000")
+
+
+def create_investor_engine(url, pool_size=POOL_SIZE):
+    engine = create_engine(url, pool_size=pool_size)
+    if engine.dialect.name == "sqlite":
+        @event.listens_for(engine, "connect")
+        def set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma in SQLITE_PRAGMAS:
+                cursor.execute(f"PRAGMA {pragma}")
+            cursor.close()
+    return engine
+
+
+class CompanyRepository:
+    """Data access of the menus, with every call in a session or connection of its own.
+
+    Sessions don't expire their objects on commit, so the companies a call returns
+    stay readable afterwards without being selected again.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.Session = sessionmaker(bind=engine, expire_on_commit=False)
+
+    def create(self, company, financial):
+        """Add a company and its financials unless the ticker is taken, and return whether they were added."""
+        with self.Session.begin() as session:
+            if session.get(Company, company.ticker) is not None:
+                return False
+            session.add_all([company, financial])
+        return True
+
+    def search(self, name):
+        """Return the companies whose name contains name, ignoring case, names starting with it first."""
+        with self.Session() as session:
+            if len(name) < 3:
+                # trigrams can't match fewer than three characters
+                return session.query(Company).filter(Company.name.like(f"%{name}%")).order_by(
+                    Company.name.like(f"{name}%").desc(), Company.name
+                ).all()
+            query = '"' + name.replace('"', '""') + '"'
+            return session.query(Company).from_statement(
+                SEARCH_QUERY.bindparams(query=query, prefix=f"{name}%")
+            ).all()
+
+    def indicators(self, ticker):
+        # a plain row reads the same as an Indicator, without the cost of a session
+        with self.engine.connect() as connection:
+            return connection.execute(select(*Indicator.__table__.c).where(Indicator.ticker == ticker)).first()
+
+    def update_financials(self, ticker, values):
+        """Set the financials of ticker to values, and return whether the ticker has financials."""
+        with self.engine.begin() as connection:
+            return connection.execute(update(Financial).where(Financial.ticker == ticker).values(values)).rowcount > 0
+
+    def delete(self, ticker):
+        with self.engine.begin() as connection:
+            connection.execute(delete(Company).where(Company.ticker == ticker))
+
+    def all(self):
+        with self.Session() as session:
+            return session.query(Company).order_by(Company.ticker).all()
+
+    def top_ten(self, column):
+        """Return (ticker, value) rows of the ten largest values of an Indicator column, skipping NULLs."""
+        query = (
+            select(Company.ticker, column)
+            .join(Indicator, Indicator.ticker == Company.ticker)
+            .where(column.is_not(None))
+            .order_by(column.desc())
+            .limit(10)
+        )
+        with self.engine.connect() as connection:
+            return connection.execute(query).all()
+
+    def import_csv(self, path, batch_size=1000):
+        with self.engine.begin() as connection:
+            return import_csv(path, connection, batch_size)
 
+    def rebuild_indicators(self):
+        with self.engine.begin() as connection:
+            rebuild_indicators(connection)
 
-# Create the tables in the database if they don't exist
-Base.metadata.create_all(engine)
+    def rebuild_search(self):
+        with self.engine.begin() as connection:
+            rebuild_search(connection)
+
+
+# Connect to the database and create the tables if they don't exist
+engine = create_investor_engine(DATABASE_URL)
+create_schema(engine)
+repository = CompanyRepository(engine)
 
 
 def main_menu():
@@ -101,9 +366,9 @@ def main():
                 option = get_option("Enter an option: ")
                 if option == 0:
                     break
-                elif 1 <= option <= 3:
-                    print("Not implemented!")
-                    break  # Go back to the main menu after implementing the feature
+                elif option in TOP_TEN:
+                    list_top_ten(*TOP_TEN[option])
+                    break
                 else:
                     print("Invalid option!")
         else:
@@ -125,43 +390,33 @@ def create_company():
     cash_equivalents = float(input("Enter cash equivalents (in the format '987654321'): "))
     liabilities = float(input("Enter liabilities (in the format '987654321'): "))
 
-    # Check if the ticker already exists
-    existing_company = session.query(Company).filter_by(ticker=ticker).first()
-    if existing_company:
-        print(f"A company with ticker '{ticker}' already exists.")
-        # Optionally, ask if the user wants to update the existing company here
-    else:
-        # Create an instance of the Company class with the provided details
-        new_company = Company(ticker=ticker, name=company_name, sector=sector)
-        new_financial = Financial(
-            ticker=ticker,
-            ebitda=ebitda,
-            sales=sales,
-            net_profit=net_profit,
-            market_price=market_price,
-            net_debt=net_debt,
-            assets=assets,
-            equity=equity,
-            cash_equivalents=cash_equivalents,
-            liabilities=liabilities
-        )
-
-        # Add the new company to the session and commit it to the database
-        session.add(new_company)
-        session.add(new_financial)
-        session.commit()
-
+    # Create an instance of the Company class with the provided details
+    new_company = Company(ticker=ticker, name=company_name, sector=sector)
+    new_financial = Financial(
+        ticker=ticker,
+        ebitda=ebitda,
+        sales=sales,
+        net_profit=net_profit,
+        market_price=market_price,
+        net_debt=net_debt,
+        assets=assets,
+        equity=equity,
+        cash_equivalents=cash_equivalents,
+        liabilities=liabilities
+    )
+
+    # Added only if the ticker doesn't exist yet
+    if repository.create(new_company, new_financial):
         print("Company created successfully!")
-
-    # Close the session
-    session.close()
+    else:
+        print(f"A company with ticker '{ticker}' already exists.")
 
 
 def read_company():
     company_name = input("Enter company name: ")
 
     # Find companies matching the input name
-    companies = session.query(Company).filter(Company.name.like(f"%{company_name}%")).all()
+    companies = repository.search(company_name)
 
     # Check if any companies were found
     if not companies:
@@ -180,28 +435,19 @@ def read_company():
         print("Invalid company number!")
         return
 
-    # Get the financial data for the selected company using SQLAlchemy
-    financial_data = session.query(Financial).filter(Financial.ticker == selected_company.ticker).one_or_none()
-
-    if financial_data:
-        # Calculate financial indicators
-        p_e = financial_data.market_price / financial_data.net_profit if financial_data.net_profit else None
-        p_s = financial_data.market_price / financial_data.sales if financial_data.sales else None
-        p_b = financial_data.market_price / financial_data.assets if financial_data.assets else None
-        nd_ebitda = financial_data.net_debt / financial_data.ebitda if financial_data.ebitda else None
-        roe = financial_data.net_profit / financial_data.equity if financial_data.equity else None
-        roa = financial_data.net_profit / financial_data.assets if financial_data.assets else None
-        l_a = financial_data.liabilities / financial_data.assets if financial_data.assets else None
+    # The indicators are kept up to date from the financial data by triggers
+    indicators = repository.indicators(selected_company.ticker)
 
+    if indicators:
         # Print financial indicators
         print(f"Financial indicators for {selected_company.name} ({selected_company.ticker}):")
-        print(f"P/E: {p_e}")
-        print(f"P/S: {p_s}")
-        print(f"P/B: {p_b}")
-        print(f"ND/EBITDA: {nd_ebitda}")
-        print(f"ROE: {roe}")
-        print(f"ROA: {roa}")
-        print(f"L/A: {l_a}")
+        print(f"P/E: {indicators.p_e}")
+        print(f"P/S: {indicators.p_s}")
+        print(f"P/B: {indicators.p_b}")
+        print(f"ND/EBITDA: {indicators.nd_ebitda}")
+        print(f"ROE: {indicators.roe}")
+        print(f"ROA: {indicators.roa}")
+        print(f"L/A: {indicators.l_a}")
 
     else:
         print("Financial data not found for the selected company.")
@@ -210,7 +456,7 @@ def read_company():
 def update_company():
     print("Enter company name:")
     company_name = input("> ")
-    companies = session.query(Company).filter(Company.name.like(f"%{company_name}%")).all()
+    companies = repository.search(company_name)
 
     if not companies:
         print("Company not found!")
@@ -247,21 +493,19 @@ def update_company():
     print("Enter liabilities (in the format '987654321'):")
     new_liabilities = float(input("> "))
 
-    # Find and update the financial details
-    financial_record = session.query(Financial).filter_by(ticker=selected_company.ticker).first()
-    if financial_record:
-        financial_record.ebitda = new_ebitda
-        financial_record.sales = new_sales
-        financial_record.net_profit = new_net_profit
-        financial_record.market_price = new_market_price
-        financial_record.net_debt = new_net_debt
-        financial_record.assets = new_assets
-        financial_record.equity = new_equity
-        financial_record.cash_equivalents = new_cash_equivalents
-        financial_record.liabilities = new_liabilities
-
-        # Commit the changes
-        session.commit()
+    # Update the financial details in place
+    updated = repository.update_financials(selected_company.ticker, {
+        "ebitda": new_ebitda,
+        "sales": new_sales,
+        "net_profit": new_net_profit,
+        "market_price": new_market_price,
+        "net_debt": new_net_debt,
+        "assets": new_assets,
+        "equity": new_equity,
+        "cash_equivalents": new_cash_equivalents,
+        "liabilities": new_liabilities,
+    })
+    if updated:
         print("Company updated successfully!")
     else:
         print("Financial data for this company not found. Update aborted.")
@@ -269,7 +513,7 @@ def update_company():
 
 def delete_company():
     company_name = input("Enter company name: ")
-    companies = session.query(Company).filter(Company.name.like(f"%{company_name}%")).all()
+    companies = repository.search(company_name)
 
     if not companies:
         print("Company not found!")
@@ -281,20 +525,278 @@ def delete_company():
     try:
         company_number = int(input("Enter company number: ")) - 1
         selected_company = companies[company_number]
-        session.delete(selected_company)
-        session.commit()
+        repository.delete(selected_company.ticker)
         print("Company deleted successfully!")
     except (ValueError, IndexError):
         print("Invalid company number!")
 
 
+def list_top_ten(name, column):
+    print(f"TICKER {name}")
+    for ticker, value in repository.top_ten(column):
+        print(ticker, round(value, 2))
+
+
 def list_all_companies():
     print("COMPANY LIST")
-    companies = session.query(Company).order_by(Company.ticker).all()
-    for company in companies:
+    for company in repository.all():
         print(f"{company.ticker} - {company.name} - {company.sector}")
 
 
+def benchmark_database(count, triggers=True):
+    benchmark_engine = create_engine("sqlite://")
+    create_schema(benchmark_engine)
+    with benchmark_engine.begin() as connection:
+        if not triggers:
+            drop_indicator_triggers(connection)
+        connection.execute(insert(Company), [
+            {"ticker": f"T{i}", "name": f"Company {i}", "sector": "Technology"} for i in range(count)
+        ])
+        connection.execute(insert(Financial), [
+            {column: random() * 1e9 for column in FINANCIAL_COLUMNS} | {"ticker": f"T{i}"} for i in range(count)
+        ])
+    return benchmark_engine
+
+
+def benchmark_top_ten(count):
+    benchmark_engine = benchmark_database(count)
+
+    def in_python(session, numerator, denominator):
+        rows = session.query(Financial).all()
+        values = [(row.ticker, getattr(row, numerator) / getattr(row, denominator))
+                  for row in rows if getattr(row, denominator)]
+        return sorted(values, key=lambda row: row[1], reverse=True)[:10]
+
+    def on_the_fly(connection, expression):
+        return connection.execute(
+            select(Company.ticker, expression)
+            .join(Financial, Financial.ticker == Company.ticker)
+            .where(expression.is_not(None))
+            .order_by(expression.desc())
+            .limit(10)
+        ).all()
+
+    columns = {"ND/EBITDA": ("net_debt", "ebitda"), "ROE": ("net_profit", "equity"), "ROA": ("net_profit", "assets")}
+    for name, column in TOP_TEN.values():
+        with benchmark_engine.connect() as connection:
+            started = perf_counter()
+            on_the_fly(connection, INDICATORS[column.key])
+            computed = perf_counter() - started
+            started = perf_counter()
+            CompanyRepository(benchmark_engine).top_ten(column)
+            materialized = perf_counter() - started
+        with sessionmaker(bind=benchmark_engine)() as benchmark_session:
+            started = perf_counter()
+            in_python(benchmark_session, *columns[name])
+            python = perf_counter() - started
+        print(f"{name}: {materialized * 1000:.1f} ms materialized, {computed * 1000:.1f} ms computed in SQL, "
+              f"{python * 1000:.1f} ms with ORM objects")
+
+
+def benchmark_read(count, reads=1000):
+    started = perf_counter()
+    benchmark_database(count, triggers=False)
+    without_triggers = perf_counter() - started
+    started = perf_counter()
+    benchmark_engine = benchmark_database(count)
+    with_triggers = perf_counter() - started
+    print(f"load {count} financials: {without_triggers:.2f}s without triggers, {with_triggers:.2f}s with triggers")
+    with benchmark_engine.begin() as connection:
+        started = perf_counter()
+        rebuild_indicators(connection)
+        print(f"rebuild indicators: {perf_counter() - started:.2f}s")
+
+    def computed(session, ticker):
+        financial_data = session.query(Financial).filter(Financial.ticker == ticker).one_or_none()
+        return [getattr(financial_data, numerator) / getattr(financial_data, denominator)
+                for numerator, denominator in (("market_price", "net_profit"), ("market_price", "sales"),
+                                               ("market_price", "assets"), ("net_debt", "ebitda"),
+                                               ("net_profit", "equity"), ("net_profit", "assets"),
+                                               ("liabilities", "assets"))
+                if getattr(financial_data, denominator)]
+
+    def materialized(session, ticker):
+        return session.get(Indicator, ticker)
+
+    tickers = [f"T{int(random() * count)}" for _ in range(reads)]
+    for name, read in (("computed from financials", computed), ("materialized", materialized)):
+        with sessionmaker(bind=benchmark_engine)() as benchmark_session:
+            started = perf_counter()
+            for ticker in tickers:
+                read(benchmark_session, ticker)
+                benchmark_session.expunge_all()
+            elapsed = perf_counter() - started
+        print(f"read indicators {name}: {elapsed / reads * 1e6:.0f} us per company")
+
+
+def benchmark_import(count):
+    with TemporaryDirectory() as directory:
+        path = Path(directory, "companies.csv")
+        with path.open("w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["ticker", "name", "sector", *FINANCIAL_COLUMNS])
+            for i in range(count):
+                writer.writerow([f"T{i}", f"Company {i}", "Technology", *(random() * 1e9 for _ in FINANCIAL_COLUMNS)])
+
+        # the per-object path of create_company: an existence check and a commit per company
+        orm_engine = create_engine(f"sqlite:///{Path(directory, 'orm.db')}")
+        create_schema(orm_engine)
+        started = perf_counter()
+        with sessionmaker(bind=orm_engine)() as orm_session, path.open(newline="") as file:
+            for row in csv.DictReader(file):
+                if orm_session.query(Company).filter_by(ticker=row["ticker"]).first() is None:
+                    orm_session.add(Company(ticker=row["ticker"], name=row["name"], sector=row["sector"]))
+                    orm_session.add(Financial(ticker=row["ticker"],
+                                              **{column: float(row[column]) for column in FINANCIAL_COLUMNS}))
+                    orm_session.commit()
+        orm = perf_counter() - started
+
+        bulk_engine = create_engine(f"sqlite:///{Path(directory, 'bulk.db')}")
+        create_schema(bulk_engine)
+        started = perf_counter()
+        with bulk_engine.begin() as connection:
+            import_csv(path, connection)
+        bulk = perf_counter() - started
+        # a second import of the same file updates every row
+        started = perf_counter()
+        with bulk_engine.begin() as connection:
+            import_csv(path, connection)
+        update = perf_counter() - started
+
+    print(f"ORM objects: {count / orm:.0f} rows/s")
+    print(f"bulk import: {count / bulk:.0f} rows/s")
+    print(f"bulk import over existing rows: {count / update:.0f} rows/s")
+
+
+def benchmark_search(count, searches=200):
+    syllables = [consonant + vowel for consonant in "bcdfghjklmnprstvwxz" for vowel in "aeiou"]
+    names = [" ".join("".join(choices(syllables, k=3)).title() for _ in range(2)) for _ in range(count)]
+    benchmark_engine = create_engine("sqlite://")
+    create_schema(benchmark_engine)
+    with benchmark_engine.begin() as connection:
+        connection.execute(insert(Company), [
+            {"ticker": f"T{i}", "name": name, "sector": "Technology"} for i, name in enumerate(names)
+        ])
+    queries = [name[start:start + 8] for name in choices(names, k=searches) for start in [int(random() * 6)]]
+
+    benchmark_repository = CompanyRepository(benchmark_engine)
+
+    def scan(name):
+        with benchmark_repository.Session() as search_session:
+            return search_session.query(Company).filter(Company.name.like(f"%{name}%")).all()
+
+    for label, search in (("LIKE scan", scan), ("trigram index", benchmark_repository.search)):
+        found = 0
+        started = perf_counter()
+        for query in queries:
+            found += len(search(query))
+        elapsed = perf_counter() - started
+        print(f"{label}: {elapsed / searches * 1000:.2f} ms per search, {found / searches:.1f} companies found")
+
+
+def benchmark_crud(count):
+    rows = [
+        ({"ticker": f"T{i}", "name": f"Company {i}", "sector": "Technology"},
+         {column: random() * 1e9 for column in FINANCIAL_COLUMNS} | {"ticker": f"T{i}"})
+        for i in range(count)
+    ]
+
+    def global_session(benchmark_engine):
+        # one session for the whole program that expires everything on commit, as the menus used to have
+        benchmark_session = sessionmaker(bind=benchmark_engine)()
+
+        def create(company, financial):
+            if benchmark_session.query(Company).filter_by(ticker=company["ticker"]).first() is None:
+                benchmark_session.add(Company(**company))
+                benchmark_session.add(Financial(**financial))
+                benchmark_session.commit()
+            benchmark_session.close()
+
+        def read(ticker):
+            return benchmark_session.get(Indicator, ticker)
+
+        def update_financials(ticker, values):
+            financial_record = benchmark_session.query(Financial).filter_by(ticker=ticker).first()
+            for column, value in values.items():
+                setattr(financial_record, column, value)
+            benchmark_session.commit()
+
+        def delete_company(ticker):
+            benchmark_session.delete(benchmark_session.get(Company, ticker))
+            benchmark_session.commit()
+
+        return create, read, update_financials, delete_company
+
+    def repository_scopes(benchmark_engine):
+        benchmark_repository = CompanyRepository(benchmark_engine)
+        return (
+            lambda company, financial: benchmark_repository.create(Company(**company), Financial(**financial)),
+            benchmark_repository.indicators,
+            benchmark_repository.update_financials,
+            benchmark_repository.delete,
+        )
+
+    setups = (
+        ("global session", create_engine, global_session),
+        ("repository", create_investor_engine, repository_scopes),
+    )
+    for name, make_engine, operations in setups:
+        with TemporaryDirectory() as directory:
+            benchmark_engine = make_engine(f"sqlite:///{Path(directory, 'investor.db')}")
+            create_schema(benchmark_engine)
+            create, read, update_financials, delete_company = operations(benchmark_engine)
+            runs = {
+                "create": lambda: [create(company, financial) for company, financial in rows],
+                "read": lambda: [read(company["ticker"]) for company, _ in rows],
+                "update": lambda: [update_financials(financial["ticker"], financial) for _, financial in rows],
+                "delete": lambda: [delete_company(company["ticker"]) for company, _ in rows],
+            }
+            rates = []
+            for operation, run in runs.items():
+                started = perf_counter()
+                run()
+                rates.append(f"{operation} {count / (perf_counter() - started):.0f}/s")
+            benchmark_engine.dispose()
+        print(f"{name}: {', '.join(rates)}")
+
+
 # Start the program
 if __name__ == '__main__':
-    main()
+    parser = ArgumentParser()
+    parser.add_argument("--import-csv", metavar="PATH", help="upsert the companies and financials of a CSV file")
+    parser.add_argument("--batch-size", type=int, default=1000, help="rows per insert of --import-csv")
+    parser.add_argument("--rebuild-indicators", action="store_true", help="recompute every financial indicator")
+    parser.add_argument("--rebuild-search", action="store_true", help="rebuild the company name search index")
+    parser.add_argument("--benchmark-top-ten", type=int, metavar="N", help="time the top ten rankings over N companies")
+    parser.add_argument("--benchmark-read", type=int, metavar="N", help="time reading indicators of N companies")
+    parser.add_argument("--benchmark-import", type=int, metavar="N", help="time importing N companies from a CSV")
+    parser.add_argument("--benchmark-search", type=int, metavar="N", help="time name searches over N companies")
+    parser.add_argument("--benchmark-crud", type=int, metavar="N", help="time creating, reading, updating and "
+                                                                        "deleting N companies")
+    args = parser.parse_args()
+
+    if args.import_csv:
+        started = perf_counter()
+        try:
+            imported = repository.import_csv(args.import_csv, args.batch_size)
+        except (OSError, ValueError) as error:
+            print(f"Import failed: {error}")
+        else:
+            elapsed = perf_counter() - started
+            print(f"{imported} rows imported in {elapsed:.2f}s ({imported / elapsed:.0f} rows/s)")
+    elif args.rebuild_indicators:
+        repository.rebuild_indicators()
+    elif args.rebuild_search:
+        repository.rebuild_search()
+    elif args.benchmark_top_ten:
+        benchmark_top_ten(args.benchmark_top_ten)
+    elif args.benchmark_read:
+        benchmark_read(args.benchmark_read)
+    elif args.benchmark_import:
+        benchmark_import(args.benchmark_import)
+    elif args.benchmark_search:
+        benchmark_search(args.benchmark_search)
+    elif args.benchmark_crud:
+        benchmark_crud(args.benchmark_crud)
+    else:
+        main()
@@ -0,0 +1,36 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from code_analyzer import AnalysisCache, iter_diagnostics
+
+
+class AnalysisCacheTest(unittest.TestCase):
+    def test_full_cache_keeps_every_hit_of_a_run(self):
+        with TemporaryDirectory() as directory:
+            scripts = []
+            for name in ("a.py", "b.py", "c.py"):
+                script = os.path.join(directory, name)
+                with open(script, "w") as f:
+                    f.write(f"{name[0]} = 1 ;\n")
+                scripts.append(script)
+
+            def check(misses):
+                return [list(iter_diagnostics(script)) for script in misses]
+
+            cache_path = os.path.join(directory, "cache.json")
+            expected = [list(iter_diagnostics(script)) for script in scripts]
+            cache = AnalysisCache(cache_path, max_entries=2)
+            self.assertEqual(list(cache.run(scripts, check)), expected)
+            cache.save()
+
+            # the edited file is a miss whose put() evicts the entries of the other two
+            with open(scripts[2], "w") as f:
+                f.write("c = 2 ;\n")
+            expected[2] = list(iter_diagnostics(scripts[2]))
+            cache = AnalysisCache(cache_path, max_entries=2)
+            self.assertEqual(list(cache.run(scripts, check)), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()